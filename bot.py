@@ -8,6 +8,10 @@ import logging
 import sqlite3
 import json
 import re
+import os
+import gzip
+import math
+import time
 from datetime import datetime, timedelta
 from typing import Optional, Dict, List, Tuple
 from contextlib import asynccontextmanager
@@ -29,8 +33,30 @@ CHANNEL_USERNAME = "@dmitriistorik"  # Имя канала с @
 ADMIN_ID = 5775389281  # Ваш ID (узнать у @userinfobot)
 ADDITIONAL_ADMINS = []  # Дополнительные админы
 DATABASE_NAME = "channel_monitor.db"
+DB_BUSY_TIMEOUT = 5.0  # Сколько запись ждёт заблокированную базу, секунды
 LOG_LEVEL = logging.INFO
 
+# Оповещения: отдельное сообщение на каждую подписку/отписку/упоминание.
+# При большом потоке событий можно отключить и полагаться на правила /alerts
+NOTIFY_EVERY_EVENT = True
+ALERT_METRICS = ("joins", "leaves", "mentions")
+ALERT_EWMA_ALPHA = 0.3  # Вес последнего окна в скользящем среднем
+ALERT_WARMUP_WINDOWS = 5  # Сколько окон накопить перед проверкой z-score
+
+# Хранение упоминаний: полный текст держим MENTIONS_RETENTION_DAYS дней,
+# дальше остаются только агрегированные счётчики в mentions_rollup
+MENTIONS_RETENTION_DAYS = 90
+MENTIONS_ARCHIVE_DIR = "archive"  # None - не архивировать удаляемые строки
+COMPACTION_INTERVAL = 6 * 3600  # Период фоновой очистки, секунды
+COMPACTION_BATCH_SIZE = 500  # Строк за одну транзакцию
+COMPACTION_BATCH_PAUSE = 0.2  # Пауза между транзакциями, секунды
+COMPACTION_VACUUM_PAGES = 200  # Страниц за один шаг incremental_vacuum
+
+# Резервные копии базы без остановки бота
+BACKUP_DIR = "backups"
+BACKUP_INTERVAL = 6 * 3600  # Период резервного копирования, секунды
+BACKUP_KEEP = 7  # Сколько последних снимков хранить
+
 # =================== НАСТРОЙКА ЛОГИРОВАНИЯ ===================
 logging.basicConfig(
     level=LOG_LEVEL,
@@ -51,16 +77,22 @@ dp = Dispatcher(storage=storage)
 class DatabaseManager:
     def __init__(self, db_name: str = DATABASE_NAME):
         self.db_name = db_name
+        # Очистка, VACUUM, снимки и восстановление не выполняются одновременно
+        self.maintenance_lock = asyncio.Lock()
         self.init_database()
     
     def get_connection(self):
-        return sqlite3.connect(self.db_name, check_same_thread=False)
+        return sqlite3.connect(self.db_name, timeout=DB_BUSY_TIMEOUT, check_same_thread=False)
     
     def init_database(self):
         """Инициализация базы данных"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # Для новой базы режим применяется сразу, у существующей - не меняется.
+        # Перевод существующей базы требует VACUUM и выполняется командой /vacuum
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS subscribers (
             user_id INTEGER PRIMARY KEY,
@@ -96,11 +128,44 @@ class DatabaseManager:
             replies INTEGER DEFAULT 0
         )
         ''')
-        
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS alert_rules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            metric TEXT NOT NULL,  -- joins, leaves, mentions
+            kind TEXT NOT NULL,  -- threshold, zscore
+            window_seconds INTEGER NOT NULL,
+            threshold REAL NOT NULL,
+            enabled INTEGER DEFAULT 1,
+            created_at TIMESTAMP
+        )
+        ''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS mentions_rollup (
+            date DATE,
+            chat_id INTEGER,
+            type TEXT,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY (date, chat_id, type)
+        )
+        ''')
+
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_mentions_date ON mentions (mention_date)')
+
         conn.commit()
         conn.close()
+        self._enable_wal()
         logger.info("База данных инициализирована")
     
+    def _enable_wal(self):
+        """WAL: снимок читает базу, не блокируя запись обработчиков"""
+        conn = self.get_connection()
+        try:
+            conn.execute('PRAGMA journal_mode = WAL')
+        finally:
+            conn.close()
+    
     async def add_subscriber(self, user: types.User, source: str = "direct"):
         """Добавление нового подписчика"""
         try:
@@ -250,9 +315,409 @@ class DatabaseManager:
             }
         return {"joins": 0, "leaves": 0, "mentions": 0, "forwards": 0, "replies": 0}
 
+    async def add_alert_rule(self, metric: str, kind: str, window_seconds: int, threshold: float):
+        """Добавление правила оповещения"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+        INSERT INTO alert_rules (metric, kind, window_seconds, threshold, enabled, created_at)
+        VALUES (?, ?, ?, ?, 1, ?)
+        ''', (metric, kind, window_seconds, threshold, datetime.now().isoformat(sep=' ')))
+        rule_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        logger.info(f"Добавлено правило оповещения #{rule_id}: {metric} {kind} {window_seconds}с {threshold}")
+        return rule_id
+
+    async def get_alert_rules(self):
+        """Получение всех правил оповещений"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT id, metric, kind, window_seconds, threshold, enabled
+        FROM alert_rules ORDER BY id
+        ''')
+        rules = cursor.fetchall()
+        conn.close()
+        return rules
+
+    async def delete_alert_rule(self, rule_id: int):
+        """Удаление правила оповещения"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM alert_rules WHERE id = ?', (rule_id,))
+        deleted = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        return deleted
+
+    async def set_alert_rule_enabled(self, rule_id: int, enabled: bool):
+        """Включение/выключение правила оповещения"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('UPDATE alert_rules SET enabled = ? WHERE id = ?', (int(enabled), rule_id))
+        updated = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        return updated
+
+    def _archive_mentions(self, rows: List[Tuple], archive_dir: str):
+        """Дозапись строк в сжатые помесячные файлы архива"""
+        os.makedirs(archive_dir, exist_ok=True)
+
+        by_month: Dict[str, List[Tuple]] = {}
+        for row in rows:
+            by_month.setdefault(str(row[6])[:7], []).append(row)
+
+        columns = ("id", "user_id", "username", "message_id", "chat_id", "text", "mention_date", "type")
+        for month, month_rows in by_month.items():
+            path = os.path.join(archive_dir, f"mentions-{month}.jsonl.gz")
+            with gzip.open(path, "at", encoding="utf-8") as f:
+                for row in month_rows:
+                    f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n")
+
+    async def compact_mentions(self, retention_days: int = MENTIONS_RETENTION_DAYS,
+                               archive_dir: Optional[str] = MENTIONS_ARCHIVE_DIR):
+        """Удаление упоминаний старше срока хранения небольшими транзакциями"""
+        async with self.maintenance_lock:
+            return await self._compact_mentions(retention_days, archive_dir)
+
+    async def _compact_mentions(self, retention_days: int, archive_dir: Optional[str]):
+        cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat(sep=' ')
+        removed = 0
+
+        while True:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                SELECT id, user_id, username, message_id, chat_id, text, mention_date, type
+                FROM mentions WHERE mention_date < ?
+                ORDER BY mention_date LIMIT ?
+                ''', (cutoff, COMPACTION_BATCH_SIZE))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+
+                # Архив пишем до удаления: при сбое строка может попасть
+                # в архив дважды, но не потеряется
+                if archive_dir:
+                    self._archive_mentions(rows, archive_dir)
+
+                counts: Dict[Tuple, int] = {}
+                for row in rows:
+                    key = (str(row[6])[:10], row[4], row[7])
+                    counts[key] = counts.get(key, 0) + 1
+
+                cursor.executemany('''
+                INSERT OR IGNORE INTO mentions_rollup (date, chat_id, type) VALUES (?, ?, ?)
+                ''', list(counts))
+                cursor.executemany('''
+                UPDATE mentions_rollup SET count = count + ?
+                WHERE date = ? AND chat_id = ? AND type = ?
+                ''', [(count, *key) for key, count in counts.items()])
+                cursor.executemany('DELETE FROM mentions WHERE id = ?', [(row[0],) for row in rows])
+
+                conn.commit()
+                removed += len(rows)
+            finally:
+                conn.close()
+
+            # Отдаём управление обработчикам событий между транзакциями
+            await asyncio.sleep(COMPACTION_BATCH_PAUSE)
+
+        freed = 0
+        if removed:
+            freed = await self.incremental_vacuum()
+
+        logger.info(f"Очистка упоминаний: удалено {removed}, освобождено страниц {freed}")
+        return {"removed": removed, "freed_pages": freed}
+
+    def is_incremental_vacuum(self):
+        """Включён ли режим auto_vacuum = INCREMENTAL"""
+        conn = self.get_connection()
+        try:
+            return conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+        finally:
+            conn.close()
+
+    def _enable_incremental_vacuum(self):
+        conn = self.get_connection()
+        try:
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+        finally:
+            conn.close()
+
+    async def enable_incremental_vacuum(self):
+        """Перевод существующей базы в режим INCREMENTAL полным VACUUM.
+
+        VACUUM держит эксклюзивную блокировку и временно требует места
+        примерно на размер базы, поэтому запускается только вручную.
+        """
+        if self.is_incremental_vacuum():
+            return False
+        started = time.monotonic()
+        async with self.maintenance_lock:
+            await asyncio.to_thread(self._enable_incremental_vacuum)
+        logger.info(f"База переведена в режим auto_vacuum = INCREMENTAL за {time.monotonic() - started:.1f} с")
+        return True
+
+    async def incremental_vacuum(self):
+        """Возврат свободных страниц файлу небольшими шагами"""
+        freed = 0
+        while True:
+            conn = self.get_connection()
+            try:
+                free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                if not free_pages:
+                    break
+                conn.execute(f'PRAGMA incremental_vacuum({COMPACTION_VACUUM_PAGES})').fetchall()
+                conn.commit()
+                step = free_pages - conn.execute('PRAGMA freelist_count').fetchone()[0]
+                if step <= 0:
+                    # База не в режиме INCREMENTAL - освобождать нечего
+                    break
+                freed += step
+            finally:
+                conn.close()
+            await asyncio.sleep(COMPACTION_BATCH_PAUSE)
+        return freed
+
+    @staticmethod
+    def _copy_database(source_path: str, target_path: str):
+        """Копирование базы через SQLite backup API за один шаг.
+
+        При постраничном копировании любая запись в источник с другого
+        соединения перезапускает backup с начала, поэтому копируем целиком.
+        В режиме WAL это чтение согласованного снимка, запись не блокируется.
+        Источник открывается только на чтение: отсутствующий файл - ошибка,
+        а не пустая база, скопированная поверх рабочей.
+        """
+        source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target, pages=-1)
+        finally:
+            target.close()
+            source.close()
+
+    @staticmethod
+    def _check_integrity(path: str):
+        """Проверка целостности файла базы"""
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            return conn.execute('PRAGMA integrity_check').fetchone()[0] == "ok"
+        finally:
+            conn.close()
+
+    def list_backups(self, backup_dir: str = BACKUP_DIR):
+        """Список снимков базы, новые первыми"""
+        if not os.path.isdir(backup_dir):
+            return []
+        prefix = os.path.splitext(os.path.basename(self.db_name))[0] + "-"
+        return sorted(
+            (name for name in os.listdir(backup_dir) if name.startswith(prefix) and name.endswith(".db")),
+            reverse=True
+        )
+
+    @staticmethod
+    def _make_standalone(path: str):
+        """Перевод снимка из WAL в обычный режим, чтобы он был одним файлом"""
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute('PRAGMA journal_mode = DELETE')
+        finally:
+            conn.close()
+
+    async def backup(self, backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP):
+        """Снимок базы без остановки записи, с проверкой и ротацией"""
+        async with self.maintenance_lock:
+            return await self._backup(backup_dir, keep)
+
+    async def _backup(self, backup_dir: str, keep: int, protect: Optional[str] = None):
+        os.makedirs(backup_dir, exist_ok=True)
+        prefix = os.path.splitext(os.path.basename(self.db_name))[0]
+        name = f"{prefix}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.db"
+        path = os.path.join(backup_dir, name)
+        partial = path + ".part"
+
+        started = time.monotonic()
+        try:
+            # Копирование в отдельном потоке, чтобы обработчики событий
+            # продолжали работать во время снимка
+            copy_started = time.monotonic()
+            await asyncio.to_thread(self._copy_database, self.db_name, partial)
+            copy_seconds = time.monotonic() - copy_started
+            await asyncio.to_thread(self._make_standalone, partial)
+            if not await asyncio.to_thread(self._check_integrity, partial):
+                raise sqlite3.DatabaseError(f"снимок {name} не прошёл integrity_check")
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+        for old in [backup for backup in self.list_backups(backup_dir) if backup != protect][keep:]:
+            os.remove(os.path.join(backup_dir, old))
+            logger.info(f"Удалён старый снимок: {old}")
+
+        result = {
+            "name": name,
+            "size": os.path.getsize(path),
+            "copy_seconds": copy_seconds,
+            "seconds": time.monotonic() - started
+        }
+        logger.info(
+            f"Снимок базы {name}: {result['size']} байт, шаг копирования {copy_seconds:.2f} с, "
+            f"всего {result['seconds']:.1f} с"
+        )
+        return result
+
+    async def restore(self, name: str, backup_dir: str = BACKUP_DIR):
+        """Восстановление базы из снимка. Перед этим сохраняется текущее состояние.
+
+        Запись в базу заблокирована на всё время копирования, поэтому оно
+        выполняется одним шагом, а фоновые задачи на это время приостановлены.
+        """
+        async with self.maintenance_lock:
+            # Проверки под блокировкой: ротация в backup_loop не успеет удалить снимок
+            if name not in self.list_backups(backup_dir):
+                raise FileNotFoundError(f"снимок {name} не найден")
+
+            path = os.path.join(backup_dir, name)
+            if not await asyncio.to_thread(self._check_integrity, path):
+                raise sqlite3.DatabaseError(f"снимок {name} не прошёл integrity_check")
+
+            # Ротация не должна удалить восстанавливаемый снимок
+            safety = await self._backup(backup_dir, BACKUP_KEEP, protect=name)
+
+            started = time.monotonic()
+            await asyncio.to_thread(self._copy_database, path, self.db_name)
+            lock_seconds = time.monotonic() - started
+            await asyncio.to_thread(self._enable_wal)
+
+        logger.info(
+            f"База восстановлена из снимка {name}, запись была заблокирована {lock_seconds:.2f} с, "
+            f"прежнее состояние: {safety['name']}"
+        )
+        if lock_seconds >= DB_BUSY_TIMEOUT:
+            logger.warning(
+                f"Восстановление заняло больше DB_BUSY_TIMEOUT ({DB_BUSY_TIMEOUT:g} с): "
+                f"события за это время могли не записаться"
+            )
+        return {"safety": safety["name"], "lock_seconds": lock_seconds}
+
 # Инициализация БД
 db = DatabaseManager()
 
+# =================== ПРАВИЛА ОПОВЕЩЕНИЙ ===================
+class AlertRule:
+    """Потоковое правило над одной метрикой.
+
+    Хранит только текущее и предыдущее окно плюс EWMA среднего и дисперсии
+    завершённых окон, поэтому память на правило O(1) независимо от потока.
+    Значение скользящего окна оценивается как взвешенная сумма двух соседних окон.
+    """
+
+    def __init__(self, rule_id: int, metric: str, kind: str, window_seconds: int, threshold: float):
+        self.rule_id = rule_id
+        self.metric = metric
+        self.kind = kind
+        self.window = window_seconds
+        self.threshold = threshold
+
+        self.window_start = time.monotonic()
+        self.current = 0
+        self.previous = 0
+        self.mean = 0.0
+        self.variance = 0.0
+        self.windows_seen = 0
+        self.fired_until = 0.0
+
+    def _advance(self, now: float):
+        """Закрытие прошедших окон и обновление EWMA"""
+        elapsed = int((now - self.window_start) // self.window)
+        if elapsed <= 0:
+            return
+
+        # Пустые окна после долгой тишины тоже учитываем, но EWMA сходится
+        # за несколько десятков шагов, так что дальше считать нет смысла
+        closed = [self.current] + [0] * min(elapsed - 1, 50)
+        for count in closed:
+            if self.windows_seen == 0:
+                self.mean = float(count)
+            else:
+                diff = count - self.mean
+                self.mean += ALERT_EWMA_ALPHA * diff
+                self.variance = (1 - ALERT_EWMA_ALPHA) * (self.variance + ALERT_EWMA_ALPHA * diff * diff)
+            self.windows_seen += 1
+
+        self.previous = self.current if elapsed == 1 else 0
+        self.current = 0
+        self.window_start += elapsed * self.window
+
+    def sliding_count(self, now: float):
+        """Оценка числа событий за последние window секунд"""
+        fraction = (now - self.window_start) / self.window
+        return self.previous * (1 - fraction) + self.current
+
+    def record(self, now: float):
+        """Учёт события. Возвращает описание срабатывания или None"""
+        self._advance(now)
+        self.current += 1
+
+        value = self.sliding_count(now)
+        if self.kind == "threshold":
+            tripped = value >= self.threshold
+            score = value
+        else:
+            if self.windows_seen < ALERT_WARMUP_WINDOWS:
+                return None
+            std = max(math.sqrt(self.variance), 1.0)
+            score = (value - self.mean) / std
+            tripped = score >= self.threshold
+
+        # Одно оповещение на срабатывание: молчим до конца текущего окна
+        if not tripped or now < self.fired_until:
+            return None
+        self.fired_until = now + self.window
+        return {"value": value, "score": score, "mean": self.mean}
+
+
+class AlertEngine:
+    """Набор правил оповещений, загруженный из БД"""
+
+    def __init__(self):
+        self.rules: Dict[str, List[AlertRule]] = {metric: [] for metric in ALERT_METRICS}
+
+    async def load(self, database: DatabaseManager):
+        """Перезагрузка правил из БД с сохранением накопленных счётчиков"""
+        old = {rule.rule_id: rule for rules in self.rules.values() for rule in rules}
+        self.rules = {metric: [] for metric in ALERT_METRICS}
+
+        for rule_id, metric, kind, window_seconds, threshold, enabled in await database.get_alert_rules():
+            if not enabled or metric not in self.rules:
+                continue
+            rule = old.get(rule_id)
+            if rule is None or rule.window != window_seconds or rule.kind != kind:
+                rule = AlertRule(rule_id, metric, kind, window_seconds, threshold)
+            rule.threshold = threshold
+            self.rules[metric].append(rule)
+
+        logger.info(f"Загружено правил оповещений: {sum(len(r) for r in self.rules.values())}")
+
+    def record(self, metric: str):
+        """Учёт события метрики. Возвращает список сработавших правил"""
+        now = time.monotonic()
+        tripped = []
+        for rule in self.rules.get(metric, []):
+            result = rule.record(now)
+            if result:
+                tripped.append((rule, result))
+        return tripped
+
+alert_engine = AlertEngine()
+
 # =================== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ===================
 def is_admin(user_id: int):
     """Проверка, является ли пользователь администратором"""
@@ -299,6 +764,48 @@ def create_message_link(chat_id: int, message_id: int):
         return f"https://t.me/c/{channel_id}/{message_id}"
     return f"https://t.me/c/{chat_id}/{message_id}"
 
+def parse_window(value: str):
+    """Разбор длины окна: 90, 30s, 5m, 1h, 1d -> секунды"""
+    match = re.fullmatch(r"(\d+)([smhd]?)", value.strip().lower())
+    if not match:
+        return None
+    amount, unit = int(match.group(1)), match.group(2) or "s"
+    seconds = amount * {"s": 1, "m": 60, "h": 3600, "d": 86400}[unit]
+    return seconds if seconds > 0 else None
+
+def format_window(seconds: int):
+    """Форматирование длины окна для вывода"""
+    for unit, size in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds % size == 0:
+            return f"{seconds // size}{unit}"
+    return f"{seconds}s"
+
+async def check_alerts(metric: str):
+    """Учёт события в правилах и отправка оповещения при срабатывании"""
+    for rule, result in alert_engine.record(metric):
+        if rule.kind == "threshold":
+            details = f"📈 <b>Событий за окно:</b> {result['value']:.0f} (порог {rule.threshold:g})"
+        else:
+            details = (
+                f"📈 <b>Событий за окно:</b> {result['value']:.0f} "
+                f"(обычно ~{result['mean']:.1f})\n"
+                f"📐 <b>z-score:</b> {result['score']:.1f} (порог {rule.threshold:g})"
+            )
+
+        message_text = (
+            f"🚨 <b>Сработало правило #{rule.rule_id}</b>\n\n"
+            f"📊 <b>Метрика:</b> {rule.metric}\n"
+            f"⏱ <b>Окно:</b> {format_window(rule.window)}\n"
+            f"{details}\n"
+            f"⏰ <b>Время:</b> {datetime.now().strftime('%H:%M:%S')}"
+        )
+
+        try:
+            await bot.send_message(ADMIN_ID, message_text, parse_mode="HTML")
+            logger.info(f"Отправлено оповещение по правилу #{rule.rule_id}")
+        except Exception as e:
+            logger.error(f"Ошибка при отправке оповещения по правилу #{rule.rule_id}: {e}")
+
 # =================== ОБРАБОТЧИКИ КОМАНД ===================
 # Эти обработчики должны быть ПЕРВЫМИ в коде!
 
@@ -321,6 +828,7 @@ async def cmd_start(message: Message):
             f"/stats - Статистика\n"
             f"/subscribers - Подписчики\n"
             f"/mentions - Упоминания\n"
+            f"/alerts - Правила оповещений\n"
             f"/help - Помощь",
             parse_mode="HTML",
             reply_markup=keyboard
@@ -500,6 +1008,208 @@ async def cmd_mentions(message: Message):
         logger.error(f"Ошибка при получении упоминаний: {e}")
         await message.answer("❌ Ошибка при получении упоминаний.")
 
+@dp.message(Command("alerts"))
+async def cmd_alerts(message: Message, command: CommandObject):
+    """Команда /alerts"""
+    logger.info(f"Получена команда /alerts от {message.from_user.id}")
+
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён.")
+        return
+
+    usage = (
+        "🚨 <b>Правила оповещений</b>\n\n"
+        "/alerts - Список правил\n"
+        "/alerts add &lt;метрика&gt; threshold &lt;окно&gt; &lt;порог&gt;\n"
+        "/alerts add &lt;метрика&gt; zscore &lt;окно&gt; &lt;z&gt;\n"
+        "/alerts del &lt;id&gt;\n"
+        "/alerts on|off &lt;id&gt;\n\n"
+        f"Метрики: {', '.join(ALERT_METRICS)}\n"
+        "Окно: 30s, 1m, 1h, 1d\n"
+        "Пример: <code>/alerts add leaves threshold 1h 50</code>"
+    )
+
+    args = command.args.split() if command.args else []
+
+    try:
+        if not args:
+            rules = await db.get_alert_rules()
+            if not rules:
+                await message.answer("🔕 Правил пока нет.\n\n" + usage, parse_mode="HTML")
+                return
+
+            rules_text = "🚨 <b>Правила оповещений:</b>\n\n"
+            for rule_id, metric, kind, window_seconds, threshold, enabled in rules:
+                status = "✅" if enabled else "⏸"
+                rules_text += f"{status} #{rule_id}: {metric} {kind} {format_window(window_seconds)} {threshold:g}\n"
+            await message.answer(rules_text, parse_mode="HTML")
+            return
+
+        action = args[0].lower()
+
+        if action == "add" and len(args) == 5:
+            metric, kind = args[1].lower(), args[2].lower()
+            window_seconds = parse_window(args[3])
+            try:
+                threshold = float(args[4])
+            except ValueError:
+                threshold = None
+
+            if metric not in ALERT_METRICS or kind not in ("threshold", "zscore") \
+                    or window_seconds is None or threshold is None or threshold <= 0:
+                await message.answer("❌ Неверные параметры правила.\n\n" + usage, parse_mode="HTML")
+                return
+
+            rule_id = await db.add_alert_rule(metric, kind, window_seconds, threshold)
+            await alert_engine.load(db)
+            await message.answer(f"✅ Правило #{rule_id} добавлено.")
+
+        elif action in ("del", "on", "off") and len(args) == 2 and args[1].isdigit():
+            rule_id = int(args[1])
+            if action == "del":
+                done = await db.delete_alert_rule(rule_id)
+            else:
+                done = await db.set_alert_rule_enabled(rule_id, action == "on")
+
+            if not done:
+                await message.answer(f"❌ Правило #{rule_id} не найдено.")
+                return
+
+            await alert_engine.load(db)
+            await message.answer(f"✅ Правило #{rule_id} обновлено.")
+
+        else:
+            await message.answer(usage, parse_mode="HTML")
+
+    except Exception as e:
+        logger.error(f"Ошибка при работе с правилами оповещений: {e}")
+        await message.answer("❌ Ошибка при работе с правилами оповещений.")
+
+@dp.message(Command("compact"))
+async def cmd_compact(message: Message):
+    """Команда /compact"""
+    logger.info(f"Получена команда /compact от {message.from_user.id}")
+
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён.")
+        return
+
+    try:
+        await message.answer("🧹 Очистка старых упоминаний запущена...")
+        result = await db.compact_mentions()
+        await message.answer(
+            f"✅ <b>Очистка завершена</b>\n\n"
+            f"🗓 <b>Срок хранения текста:</b> {MENTIONS_RETENTION_DAYS} дн.\n"
+            f"🗑 <b>Удалено упоминаний:</b> {result['removed']}\n"
+            f"📦 <b>Архив:</b> {MENTIONS_ARCHIVE_DIR or 'отключён'}\n"
+            f"💾 <b>Освобождено страниц:</b> {result['freed_pages']}",
+            parse_mode="HTML"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при очистке упоминаний: {e}")
+        await message.answer("❌ Ошибка при очистке упоминаний.")
+
+@dp.message(Command("vacuum"))
+async def cmd_vacuum(message: Message):
+    """Команда /vacuum"""
+    logger.info(f"Получена команда /vacuum от {message.from_user.id}")
+
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён.")
+        return
+
+    try:
+        if db.is_incremental_vacuum():
+            await message.answer("✅ База уже в режиме incremental vacuum.")
+            return
+
+        await message.answer(
+            "🧹 Перевод базы в режим incremental vacuum...\n"
+            "Запись в базу будет заблокирована до окончания VACUUM."
+        )
+        await db.enable_incremental_vacuum()
+        await message.answer("✅ Готово. Место после /compact теперь возвращается системе.")
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении VACUUM: {e}")
+        await message.answer("❌ Ошибка при выполнении VACUUM.")
+
+@dp.message(Command("backup"))
+async def cmd_backup(message: Message, command: CommandObject):
+    """Команда /backup"""
+    logger.info(f"Получена команда /backup от {message.from_user.id}")
+
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён.")
+        return
+
+    try:
+        if command.args and command.args.strip().lower() == "list":
+            backups = db.list_backups()
+            if not backups:
+                await message.answer("📭 Снимков пока нет.")
+                return
+
+            backups_text = "💾 <b>Снимки базы:</b>\n\n"
+            for name in backups:
+                size_kb = os.path.getsize(os.path.join(BACKUP_DIR, name)) / 1024
+                backups_text += f"<code>{name}</code> ({size_kb:.0f} КБ)\n"
+            backups_text += "\nВосстановить: /restore &lt;имя&gt;"
+            await message.answer(backups_text, parse_mode="HTML")
+            return
+
+        await message.answer("💾 Создаю снимок базы...")
+        result = await db.backup()
+        await message.answer(
+            f"✅ <b>Снимок создан</b>\n\n"
+            f"📄 <b>Файл:</b> <code>{result['name']}</code>\n"
+            f"📦 <b>Размер:</b> {result['size'] / 1024:.0f} КБ\n"
+            f"⏱ <b>Шаг копирования:</b> {result['copy_seconds']:.2f} с (WAL, запись не блокируется)\n"
+            f"🕐 <b>Всего:</b> {result['seconds']:.1f} с",
+            parse_mode="HTML"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при резервном копировании: {e}")
+        await message.answer("❌ Ошибка при резервном копировании.")
+
+@dp.message(Command("restore"))
+async def cmd_restore(message: Message, command: CommandObject):
+    """Команда /restore"""
+    logger.info(f"Получена команда /restore от {message.from_user.id}")
+
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён.")
+        return
+
+    name = command.args.strip() if command.args else ""
+    if not name:
+        await message.answer(
+            "Использование: /restore &lt;имя снимка&gt;\nСписок снимков: /backup list\n\n"
+            f"⚠️ На время восстановления запись в базу заблокирована. Если это дольше "
+            f"{DB_BUSY_TIMEOUT:g} с, события за это время не запишутся.",
+            parse_mode="HTML"
+        )
+        return
+
+    try:
+        result = await db.restore(name)
+        await alert_engine.load(db)
+        
+        restore_text = (
+            f"✅ <b>База восстановлена</b> из <code>{name}</code>\n\n"
+            f"⏱ <b>Запись была заблокирована:</b> {result['lock_seconds']:.2f} с\n"
+            f"Прежнее состояние сохранено в <code>{result['safety']}</code>"
+        )
+        if result['lock_seconds'] >= DB_BUSY_TIMEOUT:
+            restore_text += (
+                f"\n\n⚠️ Дольше {DB_BUSY_TIMEOUT:g} с: события за это время могли не записаться."
+            )
+        await message.answer(restore_text, parse_mode="HTML")
+    except FileNotFoundError:
+        await message.answer("❌ Снимок не найден. Список снимков: /backup list")
+    except Exception as e:
+        logger.error(f"Ошибка при восстановлении базы: {e}")
+        await message.answer("❌ Ошибка при восстановлении базы.")
+
 @dp.message(Command("help"))
 async def cmd_help(message: Message):
     """Команда /help"""
@@ -513,6 +1223,12 @@ async def cmd_help(message: Message):
             "/stats - Статистика канала\n"
             "/subscribers - Список подписчиков\n"
             "/mentions - Последние упоминания\n"
+            "/alerts - Правила оповещений\n"
+            "/compact - Очистка старых упоминаний\n"
+            "/vacuum - Включение освобождения места (однократно)\n"
+            "/backup - Снимок базы (/backup list - список)\n"
+            "/restore - Восстановление из снимка\n"
+            f"  (запись блокируется на время восстановления, события теряются после {DB_BUSY_TIMEOUT:g} с)\n"
             "/help - Эта справка\n\n"
             "<b>Что отслеживает бот:</b>\n"
             "✅ Новые подписчики\n"
@@ -525,24 +1241,14 @@ async def cmd_help(message: Message):
     else:
         await message.answer("❌ У вас нет доступа к этому боту.")
 
-# Обработчик для теста - отвечает на любое сообщение
-@dp.message()
-async def handle_any_message(message: Message):
-    """Обработчик всех сообщений"""
-    logger.info(f"Получено сообщение от {message.from_user.id}: {message.text[:50] if message.text else 'без текста'}")
-    
-    # Если не команда и не админ - игнорируем
-    if not is_admin(message.from_user.id):
-        return
-    
-    # Если админ написал что-то не команду
-    if message.text and not message.text.startswith('/'):
-        await message.answer(f"ℹ️ Для работы с ботом используйте команды:\n"
-                           f"/start - Запуск\n"
-                           f"/stats - Статистика\n"
-                           f"/help - Помощь")
-
 # =================== ОБРАБОТЧИКИ СОБЫТИЙ КАНАЛА ===================
+MEMBER_STATUSES = (
+    ChatMemberStatus.MEMBER,
+    ChatMemberStatus.RESTRICTED,
+    ChatMemberStatus.ADMINISTRATOR,
+    ChatMemberStatus.CREATOR
+)
+
 @dp.chat_member()
 async def handle_chat_member_update(event: ChatMemberUpdated):
     """Обработчик подписок и отписок"""
@@ -564,6 +1270,10 @@ async def handle_chat_member_update(event: ChatMemberUpdated):
             # Новый подписчик
             source = "direct"
             await db.add_subscriber(user, source)
+            await check_alerts("joins")
+            
+            if not NOTIFY_EVERY_EVENT:
+                return
             
             # Отправляем уведомление
             channel_info = await get_channel_info()
@@ -580,11 +1290,22 @@ async def handle_chat_member_update(event: ChatMemberUpdated):
             await bot.send_message(ADMIN_ID, message_text, parse_mode="HTML")
             logger.info(f"Отправлено уведомление о новом подписчике {user.id}")
             
-        elif event.new_chat_member.status == ChatMemberStatus.LEFT:
+        elif event.new_chat_member.status in (ChatMemberStatus.LEFT, ChatMemberStatus.KICKED):
+            # Для правил считаем каждый выход участника, даже если подписка была
+            # до запуска бота. Переход LEFT -> KICKED повторно не считается
+            if event.old_chat_member.status in MEMBER_STATUSES:
+                await check_alerts("leaves")
+            
+            if event.new_chat_member.status != ChatMemberStatus.LEFT:
+                return
+            
             # Пользователь отписался
             user_info = await db.remove_subscriber(user.id)
             
             if user_info:
+                if not NOTIFY_EVERY_EVENT:
+                    return
+                
                 total_subs = await db.get_subscribers_count()
                 
                 message_text = (
@@ -616,6 +1337,10 @@ async def handle_mentions(message: Message):
         # Проверяем упоминание канала
         if CHANNEL_USERNAME.lower() in text.lower():
             await db.add_mention(user, message, "mention")
+            await check_alerts("mentions")
+            
+            if not NOTIFY_EVERY_EVENT:
+                return
             
             message_text = (
                 "🔔 <b>Новое упоминание канала!</b>\n\n"
@@ -631,6 +1356,48 @@ async def handle_mentions(message: Message):
     except Exception as e:
         logger.error(f"Ошибка в обработчике упоминаний: {e}")
 
+# Обработчик для теста - отвечает на любое сообщение.
+# Регистрируется последним: aiogram берёт первый подходящий обработчик,
+# и без фильтра он перехватил бы упоминания канала
+@dp.message()
+async def handle_any_message(message: Message):
+    """Обработчик всех сообщений"""
+    logger.info(f"Получено сообщение от {message.from_user.id}: {message.text[:50] if message.text else 'без текста'}")
+    
+    # Если не команда и не админ - игнорируем
+    if not is_admin(message.from_user.id):
+        return
+    
+    # Если админ написал что-то не команду
+    if message.text and not message.text.startswith('/'):
+        await message.answer(f"ℹ️ Для работы с ботом используйте команды:\n"
+                           f"/start - Запуск\n"
+                           f"/stats - Статистика\n"
+                           f"/help - Помощь")
+
+# =================== ФОНОВЫЕ ЗАДАЧИ ===================
+async def compaction_loop():
+    """Периодическая очистка старых упоминаний"""
+    while True:
+        try:
+            await db.compact_mentions()
+        except Exception as e:
+            logger.error(f"Ошибка при очистке упоминаний: {e}")
+        await asyncio.sleep(COMPACTION_INTERVAL)
+
+async def backup_loop():
+    """Периодическое резервное копирование базы"""
+    while True:
+        await asyncio.sleep(BACKUP_INTERVAL)
+        try:
+            await db.backup()
+        except Exception as e:
+            logger.error(f"Ошибка при резервном копировании: {e}")
+            try:
+                await bot.send_message(ADMIN_ID, f"❌ Ошибка при резервном копировании базы: {e}")
+            except Exception as send_error:
+                logger.error(f"Не удалось отправить сообщение об ошибке копирования: {send_error}")
+
 # =================== ЗАПУСК БОТА ===================
 async def main():
     """Главная функция"""
@@ -694,6 +1461,23 @@ async def main():
         print(f"❌ Ошибка при проверке канала: {e}")
         return
     
+    # Проверка режима освобождения места
+    try:
+        if not db.is_incremental_vacuum():
+            logger.warning("База не в режиме auto_vacuum = INCREMENTAL: место после очистки "
+                           "не освобождается. Выполните /vacuum в спокойное время")
+    except Exception as e:
+        logger.error(f"Ошибка при проверке режима auto_vacuum: {e}")
+    
+    # Загрузка правил оповещений
+    await alert_engine.load(db)
+    
+    # Фоновые задачи
+    background_tasks = [
+        asyncio.create_task(compaction_loop()),
+        asyncio.create_task(backup_loop())
+    ]
+    
     # Запуск
     logger.info("Бот запущен и готов к работе")
     print("✅ Бот успешно запущен!")
@@ -704,6 +1488,9 @@ async def main():
     except Exception as e:
         logger.error(f"Ошибка при запуске поллинга: {e}")
         print(f"❌ Ошибка при запуске: {e}")
+    finally:
+        for task in background_tasks:
+            task.cancel()
 
 if __name__ == "__main__":
     try: